@@ -1,18 +1,46 @@
 import enum
+import functools
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from scipy.io import wavfile
 import json
+import re
 
 jupyter_nb_mode = False
-try:
-    assert jupyter_nb_mode
-    from IPython.display import Audio
-except:
-    import sounddevice as sd
-    def Audio(array,rate=44100):
+
+def Audio(array,rate=44100):
+    try:
+        assert jupyter_nb_mode
+        from IPython.display import Audio as IPythonAudio
+    except (AssertionError, ImportError):
+        import sounddevice as sd
         sd.play(array,rate)
+    else:
+        return IPythonAudio(array,rate=rate)
+
+_FREQS = (261.63,293.66,329.63,349.23,392.00,440.00,493.88)
+_SHORT = 'drmfslt'
+_CONS = 'pkmfslt'
+_VOW = ('o','e','i','a','u','ai','au')
+
+_GLYPH_SEGS = (
+    np.zeros((0,2,2)),
+    np.array([[(0,0),(0,-1)]]),
+    np.zeros((0,2,2)),
+    np.array([[(0,0),(1,-1)]]),
+    np.array([[(0,0),(1,0)]]),
+    np.zeros((0,2,2)),
+    np.array([[(0,0),(1,1)]]),
+)
+_GLYPH_ARCS = (((1/2,0,1/2,0,360),),(),((1/2,0,1/2,0,180),),(),(),((0,-1/2,1/2,90,270),),())
+_GLYPH_ATTACH = ((1,0),(0,-1),(1,0),(1,-1),(1,0),(0,-1),(1,1))
+_DOUBLER_SEGS = np.array([
+    [(-1/2,2/6),(-1/2,4/6)],
+    [(-1/6,1/2),(1/6,1/2)],
+    [(-1/2,2/6),(-1/2,4/6)],
+    [(-4/6,1/2),(-1/3,1/2)],
+    [(-1/2,-1/6),(-1/2,1/6)],
+    [(-2/6,1/2),(-4/6,1/2)],
+    [(-4/6,-1/2),(-1/3,-1/2)],
+])
 
 class SolfegeSymbol(enum.Enum):
     DO,Do,do,D,d,p,o = 1,1,1,1,1,1,1
@@ -24,134 +52,228 @@ class SolfegeSymbol(enum.Enum):
     SI,Si,si,TI,Ti,ti,T,t,ai = 7,7,7,7,7,7,7,7,7
 
     @property
-    def freq(self,octave=4):
-        notes = [261.63,293.66,329.63,349.23,392.00,440.00,493.88]
-        return notes[self.value-1]*(2**(octave-4))
+    def freq(self):
+        return self._freq
+
+    def freq_at(self,octave=4):
+        if octave >= 4:
+            return self._freq*(1<<(octave-4))
+        return self._freq/(1<<(4-octave))
     
     @property
     def shortname(self):
-        names = 'drmfslt'
-        return names[self.value-1]
+        return self._shortname
     
     @property
     def sescons(self):
-        names = 'pkmfslt'
-        return names[self.value-1]
+        return self._sescons
 
     @property
     def sesvowel(self):
-        names = list('oeiau')+['ai','au']
-        return names[self.value-1]
+        return self._sesvowel
     
-    def makeglyph(self,xy,scale=1,color='black',weight=2,doubler=False):
+    def glyphgeometry(self,xy,scale=1,doubler=False):
         x,y=xy
         if doubler:
-            shape = [
-                patches.FancyArrowPatch((x-scale/2,y+2*scale/6),(x-scale/2,y+4*scale/6),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-scale/6,y+scale/2),(x+scale/6,y+scale/2),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-scale/2,y+2*scale/6),(x-scale/2,y+4*scale/6),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-4*scale/6,y+scale/2),(x-scale/3,y+scale/2),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-scale/2,y-scale/6),(x-scale/2,y+scale/6),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-2*scale/6,y+scale/2),(x-4*scale/6,y+scale/2),arrowstyle='-',color=color,linewidth=weight),
-                patches.FancyArrowPatch((x-4*scale/6,y-scale/2),(x-scale/3,y-scale/2),arrowstyle='-',color=color,linewidth=weight),
-            ][self.value-1]
-            attachment = xy
+            segs, arcs, attachment = _DOUBLER_SEGS[self.value-1:self.value], (), (0,0)
+        else:
+            segs, arcs, attachment = _GLYPH_SEGS[self.value-1], _GLYPH_ARCS[self.value-1], _GLYPH_ATTACH[self.value-1]
+        arcs = [(x+cx*scale,y+cy*scale,r*scale,theta1,theta2) for cx,cy,r,theta1,theta2 in arcs]
+        return segs*scale+xy, arcs, (x+attachment[0]*scale,y+attachment[1]*scale)
+
+    def makeglyph(self,xy,scale=1,color='black',weight=2,doubler=False):
+        import matplotlib.patches as patches
+        segs, arcs, attachment = self.glyphgeometry(xy,scale,doubler)
+        if not arcs:
+            shape = patches.FancyArrowPatch(*segs[0],arrowstyle='-',color=color,linewidth=weight)
+        elif arcs[0][4]-arcs[0][3] == 360:
+            shape = patches.Circle(arcs[0][:2],arcs[0][2],fill=False,color=color,linewidth=weight)
         else:
-            shape, attachment = [
-                (patches.Circle((x+scale/2,y),scale/2,fill=False,color=color,linewidth=weight),(x+scale,y)),
-                (patches.FancyArrowPatch((x,y),(x,y-scale),arrowstyle='-',color=color,linewidth=weight),(x,y-scale)),
-                (patches.Arc((x+scale/2,y),scale,scale,theta1=0.0,theta2=180.0,color=color,linewidth=weight),(x+scale,y)),
-                (patches.FancyArrowPatch((x,y),(x+scale,y-scale),arrowstyle='-',color=color,linewidth=weight),(x+scale,y-scale)),
-                (patches.FancyArrowPatch((x,y),(x+scale,y),arrowstyle='-',color=color,linewidth=weight),(x+scale,y)),
-                (patches.Arc((x,y-scale/2),scale,scale,theta1=90.0,theta2=-90.0,color=color,linewidth=weight),(x,y-scale)),
-                (patches.FancyArrowPatch((x,y),(x+scale,y+scale),arrowstyle='-',color=color,linewidth=weight),(x+scale,y+scale))
-            ][self.value-1]
+            cx,cy,r,theta1,theta2 = arcs[0]
+            shape = patches.Arc((cx,cy),2*r,2*r,theta1=theta1,theta2=theta2,color=color,linewidth=weight)
         return shape, attachment
 
-def generate_note(frequency, duration, sample_rate=44100, amplitude=1, envelope_ratio=1/3):
-    fmul = 2*frequency*np.pi/sample_rate
-    note = np.sin(fmul*np.arange(sample_rate*duration))
-    env_time = int(envelope_ratio*sample_rate*duration)
-    envelope = np.concatenate((np.linspace(0,amplitude,env_time),amplitude*np.ones(int(sample_rate*duration-2*env_time)),np.linspace(amplitude,0,env_time)))
-    return note*envelope
+for _smb in SolfegeSymbol:
+    _smb._freq = _FREQS[_smb.value-1]
+    _smb._shortname = _SHORT[_smb.value-1]
+    _smb._sescons = _CONS[_smb.value-1]
+    _smb._sesvowel = _VOW[_smb.value-1]
+del _smb
+
+_FULL_RE = re.compile(r'(?i:sol(?!a))|..?', re.S)
+_SES_RE = re.compile(r'ai|au|.', re.S)
+_SYMBOLS = tuple(SolfegeSymbol(v) for v in range(1,8))
+_NAME_VALUES = {name: smb._value_ for name,smb in SolfegeSymbol.__members__.items()}
+_FULL_VALUES = dict(_NAME_VALUES)
+_FULL_VALUES.update((s+o+l, SolfegeSymbol.SOL._value_) for s in 'sS' for o in 'oO' for l in 'lL')
+_SES_VALUES = {name: v for name,v in _NAME_VALUES.items() if len(name) == 1}
+_SES_VALUES.update(ai=SolfegeSymbol.LA._value_, au=SolfegeSymbol.SI._value_)
+_FULLNAMES = tuple(smb.name.lower() for smb in _SYMBOLS)
+
+_VALID_VALUES = frozenset(range(1,8))
+
+def _symbol_values(values):
+    values = tuple(values)
+    if not _VALID_VALUES.issuperset(values):
+        raise ValueError(f'{list(values)} contains invalid SolfegeSymbol values')
+    return values
+
+_PUNCT_TABLE = str.maketrans('','','!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~')
+
+_rng = np.random.default_rng()
+
+@functools.lru_cache(maxsize=16)
+def _sample_grid(n):
+    grid = np.arange(n, dtype=np.float32)
+    grid.flags.writeable = False
+    return grid
+
+@functools.lru_cache(maxsize=32)
+def _envelope(n, amplitude, envelope_ratio):
+    env_time = int(envelope_ratio*n)
+    envelope = np.full(n, amplitude, dtype=np.float32)
+    envelope[:env_time] = np.linspace(0,amplitude,env_time)
+    envelope[n-env_time:] = np.linspace(amplitude,0,env_time)
+    envelope.flags.writeable = False
+    return envelope
+
+def generate_note(frequency, duration, sample_rate=44100, amplitude=1, envelope_ratio=1/3, out=None):
+    n = int(sample_rate*duration)
+    if out is None:
+        note = np.empty(n, dtype=np.float32)
+    elif out.shape != (n,):
+        raise ValueError(f'out has shape {out.shape}, expected {(n,)}')
+    else:
+        note = out
+    np.multiply(_sample_grid(n), 2*frequency*np.pi/sample_rate, out=note)
+    np.sin(note, out=note)
+    note *= _envelope(n, amplitude, envelope_ratio)
+    return note
+
+def generate_notes(frequencies, duration, sample_rate=44100, amplitude=1, envelope_ratio=1/3, dtype=np.float32):
+    dtype = np.dtype(dtype)
+    if dtype.kind not in 'if':
+        raise ValueError(f'dtype must be a signed integer or floating point type, not {dtype}')
+    n = int(sample_rate*duration)
+    fmuls = (2*np.pi/sample_rate)*np.asarray(frequencies, dtype=np.float64)
+    notes = np.outer(fmuls.astype(np.float32), _sample_grid(n))
+    np.sin(notes, out=notes)
+    notes *= _envelope(n, amplitude, envelope_ratio)
+    if dtype.kind == 'i':
+        np.clip(notes, -1, 1, out=notes)
+        notes *= np.iinfo(dtype).max
+    return notes.astype(dtype, copy=False)
+
+def _add_glyphs(ax, segs, arcs, color='black', weight=2):
+    from matplotlib.collections import LineCollection, PathCollection
+    from matplotlib.path import Path
+    from matplotlib.transforms import Affine2D
+    lines = LineCollection(segs,colors=color,linewidths=weight)
+    curves = PathCollection([Affine2D().scale(r).translate(cx,cy).transform_path(Path.arc(theta1,theta2)) for cx,cy,r,theta1,theta2 in arcs],
+                            facecolors='none',edgecolors=color,linewidths=weight)
+    ax.add_collection(lines,autolim=False)
+    ax.add_collection(curves,autolim=False)
+    ax.update_datalim(np.concatenate([segs.reshape(-1,2)]+[path.get_extents().get_points() for path in curves.get_paths()]))
 
 class SolresolWord():
     def __init__(self, word, syntax='default'):
         if isinstance(word, list):
             if isinstance(word[0], SolfegeSymbol):
-                self.word = word
+                values = tuple([smb._value_ for smb in word])
             elif isinstance(word[0], str):
-                self.word = [SolfegeSymbol[s] for s in word]
+                values = tuple([_NAME_VALUES[s] for s in word])
             elif isinstance(word[0], int):
-                self.word = [SolfegeSymbol(i) for i in word]
+                values = _symbol_values(word)
+            else:
+                raise TypeError(f'cannot build a {type(self).__name__} from a list of {type(word[0]).__name__}')
         elif isinstance(word, str):
             if syntax in ['ses','s']:
-                self.word = [SolfegeSymbol[s] for s in word.replace('ai','l').replace('au','t')]
+                values = tuple([_SES_VALUES[s] for s in _SES_RE.findall(word)])
             elif syntax in ['num','#',0]:
-                self.word = [SolfegeSymbol(int(s)) for s in word.strip('0')]
+                values = _symbol_values(map(int,word.strip('0')))
             elif syntax in ['full','default']:
-                self.word = []
-                while len(word) > 0:
-                    if word.lower().startswith('sol') and not word.lower().startswith('sola'):
-                        self.word.append(SolfegeSymbol.SOL)
-                        word = word[3:]
-                    else:
-                        self.word.append(SolfegeSymbol[word[:2]])
-                        word = word[2:]
+                values = tuple([_FULL_VALUES[s] for s in _FULL_RE.findall(word)])
+            else:
+                raise ValueError(f'unknown syntax {syntax!r}')
         elif isinstance(word, int):
-            self.word = [SolfegeSymbol(int(s)) for s in oct(word)[2:].strip('0')]
-            
+            values = _symbol_values(map(int,oct(word)[2:].strip('0')))
+        else:
+            raise TypeError(f'cannot build a {type(self).__name__} from {type(word).__name__}')
+        self._values = values
+
+    @functools.cached_property
+    def word(self):
+        return tuple([_SYMBOLS[v-1] for v in self._values])
     def __repr__(self):
         return f"{type(self).__name__}(['"+"','".join(smb.name for smb in self.word)+"'])"
     def __getitem__(self,ix):
         return self.word.__getitem__(ix)
     def __len__(self):
-        return len(self.word)
+        return len(self._values)
     def __iter__(self):
         return iter(self.word)
-    @property
+    @functools.cached_property
     def ses(self):
-        if len(self) == 1:
-            return self.word[0].sesvowel
-        else:
-            return ''.join(ltr.sescons if ix%2==0 else ltr.sesvowel for ix,ltr in enumerate(self.word))
-    @property
+        if len(self._values) == 1:
+            return _VOW[self._values[0]-1]
+        return ''.join([_CONS[v-1] if ix%2==0 else _VOW[v-1] for ix,v in enumerate(self._values)])
+    @functools.cached_property
     def fulltext(self):
-        return ''.join(smb.name for smb in self.word).lower()
+        return ''.join([_FULLNAMES[v-1] for v in self._values])
     def __str__(self):
         return self.fulltext
     @property
     def value(self):
-        return int(''.join(str(ltr.value) for ltr in self.word),8)
-    @property
+        value = 0
+        for v in self._values:
+            value = value<<3 | v
+        return value
+    @functools.cached_property
     def definition(self):
-        return solresol_dict[self.fulltext]
+        return _get_dict()[self.fulltext]
+    @functools.cached_property
+    def definitions(self):
+        return [dfn.strip() for dfn in self.definition.split(',')]
     def __int__(self):
         return self.value
-    def melody(self, note_len=0.2, amplitude=1, envelope_ratio=0.2, sample_rate=44100):
-        return np.concatenate([generate_note(ltr.freq,note_len,sample_rate,amplitude,envelope_ratio) for ltr in self.word])
-    def draw(self,ax,color='black',weight=2,startpos=(0,0)):
+    def melody(self, note_len=0.2, amplitude=1, envelope_ratio=0.2, sample_rate=44100, dtype=np.float32):
+        return generate_notes([_FREQS[v-1] for v in self._values],note_len,sample_rate,amplitude,envelope_ratio,dtype).ravel()
+    def glyphgeometry(self,startpos=(0,0)):
         pos=startpos
+        segs, arcs = [np.zeros((0,2,2))], []
         for ix,ltr in enumerate(self.word):
             if ltr==SolfegeSymbol.LA and (self.word[ix-1]==SolfegeSymbol.SI or self.word[ix-1]==SolfegeSymbol.DO) and ix>0:
                 pos = (pos[0]+0.5,pos[1]+0.5)
-            g,pos = ltr.makeglyph(pos,color=color,weight=weight,doubler=(ltr==self.word[ix-1] and ix>0))
-            ax.add_patch(g)
-        ax.axis('scaled')
-        ax.axis('off')
-        return pos[0]+2,startpos[1]
+            s,a,pos = ltr.glyphgeometry(pos,doubler=(ltr==self.word[ix-1] and ix>0))
+            segs.append(s)
+            arcs.extend(a)
+        return np.concatenate(segs), arcs, (pos[0]+2,startpos[1])
+    def draw(self,ax,color='black',weight=2,startpos=(0,0),finalize=True):
+        segs, arcs, pos = self.glyphgeometry(startpos)
+        _add_glyphs(ax,segs,arcs,color=color,weight=weight)
+        if finalize:
+            ax.axis('scaled')
+            ax.axis('off')
+        return pos
 
 class Solresol():
     def __init__(self, text, syntax='default'):
         if isinstance(text,str):
-            text = text.translate(str.maketrans('','','!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'))
-            self.words = [SolresolWord(word,syntax) for word in text.split()]
+            text = text.translate(_PUNCT_TABLE)
+            self.words = tuple([SolresolWord(word,syntax) for word in text.split()])
         elif isinstance(text,list):
-            self.words = [SolresolWord(word,syntax) for word in text]
+            self.words = tuple([SolresolWord(word,syntax) for word in text])
         elif isinstance(text,int):
-            sw = oct(text)[2:]
-            self.words = [SolresolWord(int(sw[i:i+5],8)) for i in range(0,len(sw),5)]
-    @property
+            if text < 0:
+                raise ValueError(f'cannot build a Solresol from negative int {text}')
+            text <<= 3*(-((text.bit_length()+2)//3) % 5)
+            words = [SolresolWord(text & 0o77777)]
+            text >>= 15
+            while text:
+                words.append(SolresolWord(text & 0o77777))
+                text >>= 15
+            self.words = tuple(words[::-1])
+    @functools.cached_property
     def fulltext(self):
         return ' '.join(word.fulltext for word in self.words)
     @property
@@ -162,7 +284,11 @@ class Solresol():
         return [int(word) for word in self.words]
     @property
     def value(self):
-        return int(''.join(oct(num)[2:].ljust(5,'0') for num in self.numlist),8)
+        value = 0
+        for word in self.words:
+            width = max(len(word),5)
+            value = value<<3*width | word.value<<3*(width-len(word))
+        return value
     def __int__(self):
         return self.value
     def __str__(self):
@@ -175,15 +301,21 @@ class Solresol():
         return iter(self.words)
     def __repr__(self):
         return f"Solresol('{str(self)}')"
-    def melody(self, note_len=0.2, amplitude=1, envelope_ratio=0.2, gap_ratio=1, sample_rate=44100):
-        notes = []
+    def melody(self, note_len=0.2, amplitude=1, envelope_ratio=0.2, gap_ratio=1, sample_rate=44100, dtype=np.float32):
+        notes = generate_notes([_FREQS[v-1] for word in self.words for v in word._values],note_len,sample_rate,amplitude,envelope_ratio,dtype)
+        n_note = notes.shape[1]
+        n_gap = int(note_len*sample_rate*gap_ratio)
+        out = np.zeros(notes.size+len(self.words)*n_gap, dtype=notes.dtype)
+        pos, row = 0, 0
         for word in self.words:
-            notes.append(word.melody(note_len, amplitude, envelope_ratio, sample_rate))
-            notes.append(np.zeros(int(note_len*sample_rate*gap_ratio)))
-        return np.concatenate(notes)
+            out[pos:pos+len(word)*n_note] = notes[row:row+len(word)].ravel()
+            pos += len(word)*n_note+n_gap
+            row += len(word)
+        return out
     def play(self, note_len=0.2, amplitude=1, envelope_ratio=0.2, gap_ratio=1):
-        return Audio(self.melody(note_len, amplitude, envelope_ratio, gap_ratio, 44100),rate=44100)
+        return Audio(self.melody(note_len, amplitude, envelope_ratio, gap_ratio, 44100, np.int16),rate=44100)
     def draw(self,color='black',weight=2,subplot_mode=False,rowmax=5):
+        import matplotlib.pyplot as plt
         if len(self) > 1 and subplot_mode:
             fig,axs = plt.subplots(len(self)//rowmax+1,(len(self)-1)%rowmax+1)
             for word,ax in zip(self.words,axs):
@@ -191,21 +323,38 @@ class Solresol():
         else:
             fig,ax = plt.subplots()
             pos = (0,0)
+            segs, arcs = [np.zeros((0,2,2))], []
             for word in self.words:
-                pos = word.draw(ax,color=color,weight=weight,startpos=pos)
+                s,a,pos = word.glyphgeometry(pos)
+                segs.append(s)
+                arcs.extend(a)
+            _add_glyphs(ax,np.concatenate(segs),arcs,color=color,weight=weight)
+            ax.axis('scaled')
+            ax.axis('off')
         return fig
-    def translate(self,alldefs=False,random=False,ix=0):
+    def translate(self,alldefs=False,random=False,ix=0,rng=None):
+        if random and not alldefs:
+            ixs = (_rng if rng is None else rng).integers(0,[len(word.definitions) for word in self.words])
         translation = []
-        for word in self.words:
+        for wx,word in enumerate(self.words):
             if alldefs:
                 translation.append(f'{word.fulltext}: ({word.definition})')
             else:
-                dfn = word.definition.split(',')
-                ix = np.random.randint(len(dfn)) if random else ix
-                translation.append(dfn[ix].strip())
+                translation.append(word.definitions[ixs[wx] if random else ix])
         return ' '.join(translation)
 
-with open('solresol_dict.json') as f:
-    solresol_dict = json.load(f)
+_dict_cache = None
+
+def _get_dict():
+    global _dict_cache
+    if _dict_cache is None:
+        with open('solresol_dict.json') as f:
+            _dict_cache = json.load(f)
+    return _dict_cache
+
+def __getattr__(name):
+    if name == 'solresol_dict':
+        return _get_dict()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 dictionary_url = "https://docs.google.com/spreadsheets/d/1-3lBxMURGN4AtGG846kuVGVNuEiHewCT88PiBahnODA/edit#gid=0"